@@ -1,101 +1,288 @@
+import asyncio
 from datetime import datetime, timedelta
-from typing import Dict, List
+from typing import Dict, Iterator, List, NamedTuple, Optional, Union
 
+import httpx
+import numpy as np
 import pandas as pd
 import requests
 import streamlit as st
-from openai import OpenAI
+from openai import APIConnectionError, APIStatusError, APITimeoutError, OpenAI
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from cache import FileCache
 
 # constants
 DEEPSEEK_BASE_URL = "https://api.deepseek.com"
 DEEPSEEK_MODEL = "deepseek-chat"  # can be changed to deepseek-reasoner
 FMP_BASE_URL = "https://financialmodelingprep.com/api/v3"
+OHLC_COLUMNS = ['Open', 'High', 'Low', 'Close']
 SYSTEM_PROMPT = """You are a stock market analyst. Your role is to use this data 
 to answer questions about the stock"""  # deepseek initial prompt context
 stock_api_key = st.secrets["stock_api_key"]
 deepseek_api_key = st.secrets["deepseek_api_key"]
+file_cache = FileCache()  # on-disk cache shared across restarts
+
+
+class StockBundle(NamedTuple):
+    """Daily bars for one symbol as plain numpy arrays, newest first."""
+    symbol: str
+    dates: np.ndarray  # datetime64[D]
+    ohlc: np.ndarray  # float32, shape (N, 4), columns as OHLC_COLUMNS
+    volume: np.ndarray  # int64
+
+    def to_frame(self) -> pd.DataFrame:
+        """DataFrame view of the bundle, used for the disk cache and chat context."""
+        df = pd.DataFrame(
+            self.ohlc,
+            columns=OHLC_COLUMNS,
+            index=pd.Index(self.dates, name='date')
+        )
+        df['Volume'] = self.volume
+        return df
+
+    @classmethod
+    def from_frame(cls, symbol: str, df: pd.DataFrame) -> "StockBundle":
+        """Rebuild a bundle from `to_frame` output."""
+        return cls(
+            symbol=symbol,
+            dates=df.index.to_numpy().astype('datetime64[D]'),
+            ohlc=df[OHLC_COLUMNS].to_numpy(dtype=np.float32),
+            volume=df['Volume'].to_numpy(dtype=np.int64)
+        )
+
+
+@st.cache_resource
+def get_fmp_session() -> requests.Session:
+    """
+    Shared FMP session, keeps the HTTPS connection pool alive across
+    reruns and user sessions.
+    """
+    session = requests.Session()
+    session.headers.update({"Accept": "application/json"})
+    session.mount("https://", HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=16,
+        max_retries=Retry(
+            total=3,
+            backoff_factor=0.3,
+            status_forcelist=[429, 500, 502, 503, 504],
+            raise_on_status=False  # let raise_for_status report the final error
+        )
+    ))
+    return session
+
+
+@st.cache_resource
+def get_deepseek_client() -> OpenAI:
+    """Shared DeepSeek client, built once per server and reused by all sessions."""
+    print(f"starting client with base URL: {DEEPSEEK_BASE_URL}")
+    return OpenAI(
+        api_key=deepseek_api_key,
+        base_url=DEEPSEEK_BASE_URL,
+        timeout=30.0
+    )
+
+
+def _fmp_params() -> Dict[str, str]:
+    """Build FMP query parameters covering the last 5 months."""
+    # calculate date range (5 months of data)
+    end_date = datetime.now() - timedelta(days=1)
+    start_date = end_date - timedelta(days=5 * 30)
+
+    return {
+        "from": start_date.strftime("%Y-%m-%d"),
+        "to": end_date.strftime("%Y-%m-%d"),
+        "apikey": stock_api_key
+    }
+
+
+def _cache_key(symbol: str, params: Dict[str, str]) -> str:
+    """On-disk cache key for a symbol and date range."""
+    return FileCache.make_key(symbol, params["from"], params["to"])
+
+
+def _read_cache(symbol: str, cache_key: str) -> Optional[StockBundle]:
+    """Load a recently fetched bundle from disk, if there is one."""
+    cached_df = file_cache.get(cache_key)
+    if cached_df is None:
+        return None
+    return StockBundle.from_frame(symbol, cached_df)
+
+
+def _parse_historical(data: Dict, symbol: str) -> StockBundle:
+    """Convert an FMP historical-price-full response into a StockBundle."""
+    if 'Error Message' in data:
+        # FMP reports some failures (bad key, plan limits) in a 200 response
+        raise ValueError(data['Error Message'])
+
+    historical_data = data.get('historical', [])
+    if not historical_data:
+        raise ValueError(f"No historical data found for symbol: {symbol}")
+
+    # only OHLCV is used, the rest of the payload (vwap, change, etc.) is
+    # skipped. float32 prices halve the memory kept in session state.
+    return StockBundle(
+        symbol=symbol,
+        dates=np.array(
+            [day['date'] for day in historical_data],
+            dtype='datetime64[D]'
+        ),
+        ohlc=np.array(
+            [[day['open'], day['high'], day['low'], day['close']]
+             for day in historical_data],
+            dtype=np.float32
+        ),
+        volume=np.array(
+            [day['volume'] for day in historical_data],
+            dtype=np.int64  # some volumes exceed int32
+        )
+    )
 
 
-def get_stock_data(api_key: str, symbol: str) -> pd.DataFrame:
+@st.cache_data(ttl=60 * 60 * 6, show_spinner=False)  # daily bars, refresh every 6h
+def get_stock_data(symbol: str) -> StockBundle:
     """
     Fetch historical stock data using the Financial Modeling Prep API.
 
+    Results are cached in memory for 6 hours per symbol, so reruns and
+    symbol switches don't hit the API again. Responses are also kept on
+    disk for 12 hours so server restarts don't use up the FMP quota.
+
     Args:
-        api_key (str): FMP API key
         symbol (str): Stock symbol ('AAPL', 'GOOGL', etc)
 
     Returns:
-        pd.DataFrame: Historical stock data with columns:
-            - Open: Opening price
-            - High: Highest price
-            - Low: Lowest price
-            - Close: Closing price
-            - Adjusted Close: Adjusted closing price
-            - Volume: Trading volume
+        StockBundle: Historical stock data, newest day first:
+            - dates: Trading days
+            - ohlc: Open, High, Low and Close prices, one row per day
+            - volume: Trading volume
 
     Raises:
         ValueError: If API request fails or no data is found
     """
-    # calculate date range (5 months of data)
-    end_date = datetime.now() - timedelta(days=1)
-    start_date = end_date - timedelta(days=5 * 30)
+    params = _fmp_params()
+
+    # serve from disk if fetched recently
+    cache_key = _cache_key(symbol, params)
+    cached = _read_cache(symbol, cache_key)
+    if cached is not None:
+        return cached
 
     try:
         url = f"{FMP_BASE_URL}/historical-price-full/{symbol}"
-        params = {
-            "from": start_date.strftime("%Y-%m-%d"),
-            "to": end_date.strftime("%Y-%m-%d"),
-            "apikey": api_key
-        }
-        response = requests.get(url, params=params)
+        response = get_fmp_session().get(url, params=params, timeout=10)
         response.raise_for_status()
+    except (requests.HTTPError, requests.Timeout, requests.ConnectionError) as e:
+        # chained so callers can inspect the original error, see is_quota_error
+        raise ValueError(f"Failed to fetch stock data: {str(e)}") from e
 
-        data = response.json()
-        historical_data = data.get('historical', [])
-        if not historical_data:
-            raise ValueError(f"No historical data found for symbol: {symbol}")
-
-        df = pd.DataFrame(historical_data)
-        df['date'] = pd.to_datetime(df['date'])
-        df.set_index('date', inplace=True)
-
-        # column name mapping
-        column_mapping = {
-            'open': 'Open',
-            'high': 'High',
-            'low': 'Low',
-            'close': 'Close',
-            'adjClose': 'Adjusted Close',
-            'volume': 'Volume'
-        }
-        df.rename(columns=column_mapping, inplace=True)
+    bundle = _parse_historical(response.json(), symbol)
+    file_cache.set(cache_key, bundle.to_frame())
+    return bundle
 
-        return df
 
-    except requests.RequestException as e:
-        raise ValueError(f"Failed to fetch stock data: {str(e)}")
+def is_quota_error(error: Exception) -> bool:
+    """Check whether a `get_stock_data` error was FMP's rate limit (HTTP 429)."""
+    cause = error.__cause__
+    return (
+        isinstance(cause, requests.HTTPError)
+        and cause.response is not None
+        and cause.response.status_code == 429
+    )
+
+
+async def _fetch_one(
+    client: httpx.AsyncClient,
+    symbol: str,
+    params_base: Dict[str, str]
+) -> None:
+    """Fetch one symbol's data into the on-disk cache, unless it's fresh."""
+    cache_key = _cache_key(symbol, params_base)
+    # file access blocks, keep it off the event loop
+    if await asyncio.to_thread(file_cache.is_fresh, cache_key):
+        return
+
+    url = f"{FMP_BASE_URL}/historical-price-full/{symbol}"
+    response = await client.get(url, params=params_base)
+    response.raise_for_status()
+
+    bundle = _parse_historical(response.json(), symbol)
+    await asyncio.to_thread(file_cache.set, cache_key, bundle.to_frame())
+
+
+async def prefetch_all(symbols: List[str]) -> None:
+    """
+    Warm the on-disk cache for several symbols with concurrent requests.
+
+    `get_stock_data` then serves these symbols from disk. Symbols that
+    fail here are fetched again by `get_stock_data` when requested.
+    Nothing is fetched if the cache directory can't be written (read-only
+    or full disk), as the data would be thrown away.
+
+    Args:
+        symbols (List[str]): Stock symbols to fetch
+    """
+    if not await asyncio.to_thread(file_cache.is_writable):
+        return
+
+    params_base = _fmp_params()
+    async with httpx.AsyncClient(
+        timeout=10,
+        headers={"Accept": "application/json"}
+    ) as client:
+        await asyncio.gather(
+            *[_fetch_one(client, symbol, params_base) for symbol in symbols],
+            return_exceptions=True
+        )
+
+
+def _log_chat_error(error: Exception) -> None:
+    """Print a DeepSeek failure, with the traceback if it was unexpected."""
+    if isinstance(error, (APIConnectionError, APITimeoutError, APIStatusError)):
+        # expected API failures, the message is enough
+        print(f"API error: {str(error)}")
+        return
+
+    import traceback
+    error_details = "".join(traceback.format_exception(error))
+    print(f"Error details: {error_details}")
+
+
+def _stream_text(response) -> Iterator[str]:
+    """Forward streamed tokens as they arrive, logging errors raised mid-stream."""
+    try:
+        for chunk in response:
+            if chunk.choices:
+                yield chunk.choices[0].delta.content or ""
     except Exception as e:
-        raise ValueError(f"Error processing stock data: {str(e)}")
+        _log_chat_error(e)
+        raise
 
 
-def deepseek_chat(api_key: str, messages: List[Dict[str, str]]) -> str:
+def deepseek_chat(
+    messages: List[Dict[str, str]],
+    stream: bool = True
+) -> Union[str, Iterator[str]]:
     """
     Generate chat responses using the DeepSeek API.
 
     Args:
-        api_key (str): DeepSeek API key
         messages
+        stream (bool): yield the response as it is generated
 
     Returns:
-        str: response from the model
+        Iterator[str] or str: response text chunks when streaming,
+            otherwise the full response from the model
+
+    Raises:
+        openai.APIError: If the API request fails. When streaming, errors
+            during the response are raised (and logged) by the iterator.
+        ValueError: If the API returns an invalid response
     """
     try:
-        print(f"starting client with base URL: {DEEPSEEK_BASE_URL}")
-        client = OpenAI(
-            api_key=api_key,
-            base_url=DEEPSEEK_BASE_URL,
-            timeout=30.0
-        )
+        client = get_deepseek_client()
 
         full_messages = [
             {"role": "system", "content": SYSTEM_PROMPT},
@@ -107,9 +294,12 @@ def deepseek_chat(api_key: str, messages: List[Dict[str, str]]) -> str:
             model=DEEPSEEK_MODEL,
             messages=full_messages,
             max_tokens=1000,  # change to add more content
-            stream=False
+            stream=stream
         )
 
+        if stream:
+            return _stream_text(response)
+
         if not response or not hasattr(response, 'choices') or not response.choices:
             print("Empty or invalid response received:", response)
             raise ValueError("Invalid response from API")
@@ -118,8 +308,5 @@ def deepseek_chat(api_key: str, messages: List[Dict[str, str]]) -> str:
         return response.choices[0].message.content
 
     except Exception as e:
-        import traceback
-        error_details = traceback.format_exc()
-        print(f"Error details: {error_details}")
-        st.error(f"API error: {str(e)}")
-        return "Cannot connect to the API. Please try again later."
+        _log_chat_error(e)
+        raise
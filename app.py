@@ -1,10 +1,12 @@
-from typing import Dict
+import asyncio
+from copy import copy
+from typing import Dict, Iterator
 
+import numpy as np
 import streamlit as st
-import pandas as pd
 import plotly.graph_objects as go
 
-from api import get_stock_data, deepseek_chat
+from api import StockBundle, get_stock_data, deepseek_chat, is_quota_error, prefetch_all
 
 # constants
 STOCK_SYMBOLS = [
@@ -20,59 +22,65 @@ EXAMPLE_PROMPTS = [
     "What is the lowest Open rate?",
     "Show me support and resistance levels"
 ]
+SEEDED_MESSAGES = 2  # stock data context + acknowledgement, hidden in the chat
+SESSION_DEFAULTS = {
+    'messages': [],
+    'current_symbol': DEFAULT_SYMBOL,
+    'stock_data': None,  # set once the current symbol has loaded
+    'prefetched': False,
+    'pending_prompt': None
+}
 
 
 def init_session_state() -> None:
     """creating session state variables."""
-    session_defaults = {
-        'messages': [],
-        'current_symbol': DEFAULT_SYMBOL,
-        'stock_data': pd.DataFrame(),
-        'pending_prompt': None
-    }
-
-    for key, value in session_defaults.items():
+    for key, value in SESSION_DEFAULTS.items():
         if key not in st.session_state:
-            st.session_state[key] = value
+            # copy so sessions never share the same list
+            st.session_state[key] = copy(value)
 
 
-def get_stock_metrics(df: pd.DataFrame) -> Dict[str, float]:
-    """Extract key stock metrics from DataFrame."""
-    if df.empty:
+def get_stock_metrics(ohlc: np.ndarray) -> Dict[str, float]:
+    """Extract key stock metrics from an (N, 4) Open/High/Low/Close array."""
+    if not ohlc.size:
         return {}
 
+    # rows are newest first, so row 0 is the latest day.
+    # plain floats, numpy float32 values fail the isinstance check in display
     return {
-        'current_price': df['Close'].iloc[-1],
-        'open_price': df['Open'].iloc[-1],
-        'high_price': df['High'].max(),
-        'low_price': df['Low'].min()
+        'current_price': float(ohlc[0, 3]),
+        'open_price': float(ohlc[0, 0]),
+        'high_price': float(ohlc[:, 1].max()),
+        'low_price': float(ohlc[:, 2].min())
     }
 
 
-def create_candlestick_chart(df: pd.DataFrame, symbol: str) -> go.Figure:
+def create_candlestick_chart(bundle: StockBundle) -> go.Figure:
     """create plotly candlestick chart from stock data."""
-    fig = go.Figure()
-
-    if not df.empty:
-        fig.add_trace(go.Candlestick(
-            x=df.index,
-            open=df['Open'],
-            high=df['High'],
-            low=df['Low'],
-            close=df['Close'],
+    # built in one constructor call so plotly validates the figure once,
+    # plotly takes the numpy columns as they are
+    data = []
+    if bundle.dates.size:
+        data.append(dict(
+            type='candlestick',
+            x=bundle.dates,
+            open=bundle.ohlc[:, 0],
+            high=bundle.ohlc[:, 1],
+            low=bundle.ohlc[:, 2],
+            close=bundle.ohlc[:, 3],
             name='Candlestick'
         ))
 
-    fig.update_layout(
-        title=f"{symbol} Stock Price",
-        yaxis_title="Price ($)",
-        xaxis_title="Date",
-        xaxis_rangeslider_visible=False,
-        height=500
+    return go.Figure(
+        data=data,
+        layout=dict(
+            title=f"{bundle.symbol} Stock Price",
+            yaxis=dict(title="Price ($)"),
+            xaxis=dict(title="Date", rangeslider=dict(visible=False)),
+            height=500
+        )
     )
 
-    return fig
-
 
 def display_stock_metrics(metrics: Dict[str, float]) -> None:
     """Display stock metrics in columns."""
@@ -93,7 +101,7 @@ def display_stock_metrics(metrics: Dict[str, float]) -> None:
 
 def display_chat_messages() -> None:
     """Display chat messages from session history."""
-    for message in st.session_state.messages:
+    for message in st.session_state.messages[SEEDED_MESSAGES:]:
         with st.chat_message(message["role"]):
             st.write(message["content"])
 
@@ -101,16 +109,17 @@ def display_chat_messages() -> None:
 def display_example_prompts() -> None:
     """Display example prompts."""
     st.write("**Try these example questions:**")
-    cols = st.columns(2)
-    for idx, prompt in enumerate(EXAMPLE_PROMPTS):
-        with cols[idx % 2]:
-            if st.button(
-                prompt,
-                key=f"ex_{idx}",
-                use_container_width=True,
-                help="Click to use this example question"
-            ):
-                st.session_state.pending_prompt = prompt
+    # a form batches the buttons into a single rerun on submit
+    with st.form("example_prompts", clear_on_submit=False, border=False):
+        cols = st.columns(2)
+        for idx, prompt in enumerate(EXAMPLE_PROMPTS):
+            with cols[idx % 2]:
+                if st.form_submit_button(
+                    prompt,
+                    use_container_width=True,
+                    help="Click to use this example question"
+                ):
+                    st.session_state.pending_prompt = prompt
 
 
 def handle_stock_selection() -> None:
@@ -120,7 +129,9 @@ def handle_stock_selection() -> None:
         new_symbol = st.selectbox(
             "Select Stock Symbol:",
             options=STOCK_SYMBOLS,
-            index=STOCK_SYMBOLS.index(st.session_state.current_symbol)
+            # fixed default, a changing index would recreate the widget and
+            # drop the next selection now that switching doesn't rerun
+            index=STOCK_SYMBOLS.index(DEFAULT_SYMBOL)
         )
 
         st.subheader("How to use:")
@@ -134,23 +145,15 @@ def handle_stock_selection() -> None:
             "The chatbot is limited to a maximum of 5 days of data.")
         st.write("API pulls the last 5 months of data.")
 
+        # data for the new symbol is loaded by main()
         if new_symbol != st.session_state.current_symbol:
             st.session_state.current_symbol = new_symbol
             st.session_state.messages = []
-            try:
-                st.session_state.stock_data = get_stock_data(
-                    st.secrets["stock_api_key"],
-                    new_symbol
-                )
-            except Exception as e:
-                st.error(f"Failed to load data: {str(e)}")
-            st.rerun()
 
 
 def process_prompt(prompt: str) -> None:
     """Common processing for both example prompts and direct input."""
-    # add user's message to history
-    st.session_state.messages.append({"role": "user", "content": prompt})
+    user_message = {"role": "user", "content": prompt}
 
     # display the user's message instantly
     with st.chat_message("user"):
@@ -158,34 +161,40 @@ def process_prompt(prompt: str) -> None:
 
     # generate and display chatbot response
     with st.chat_message("assistant"):
-        with st.spinner("Analysing stock data..."):
-            try:
-                response = generate_chat_response(prompt)
-                st.session_state.messages.append(
-                    {"role": "assistant", "content": response}
-                )
-                st.write(response)
-            except Exception as e:
-                # logging.error(f"Chat error: {str(e)}")
-                st.error("Failed to generate response. Please try again.")
-
-    # rerun to update display
-    st.rerun()
-
-
-def generate_chat_response(prompt: str) -> str:
-    """Generate chatbot response using API."""
+        try:
+            with st.spinner("Analysing stock data..."):
+                stream = generate_chat_response(user_message)
+            # write tokens as they arrive, returns the full text
+            response = st.write_stream(stream)
+        except Exception as e:
+            # logging.error(f"Chat error: {str(e)}")
+            st.error(f"Failed to generate response. Please try again. ({str(e)})")
+            return
+
+    # history only gets complete turns, it is sent to the model and must
+    # never hold a question without a reply (failures, or a rerun that
+    # interrupts streaming)
+    st.session_state.messages += [
+        user_message,
+        {"role": "assistant", "content": response}
+    ]
+
+
+def seed_chat_context() -> None:
+    """Start the chat history with the stock data, so it is sent once per chat."""
     stock_name = st.session_state.current_symbol  # stock name pulled for context
-    context = f"Stock data for {stock_name}: {st.session_state.stock_data.head(5).to_string()}"
-    messages = [{
-        "role": "user",
-        "content": f"{context}\n\nQuestion: {prompt}"
-    }]
-
-    return deepseek_chat(
-        st.secrets["deepseek_api_key"],
-        messages
-    )
+    # compact CSV costs far fewer tokens than a padded to_string() table
+    context_df = st.session_state.stock_data.to_frame().head(5).round(2)
+    context = f"Stock data for {stock_name} (last 5 days, CSV):\n{context_df.to_csv()}"
+    st.session_state.messages = [
+        {"role": "user", "content": context},
+        {"role": "assistant", "content": "Acknowledged."}
+    ]
+
+
+def generate_chat_response(user_message: Dict[str, str]) -> Iterator[str]:
+    """Generate chatbot response to the chat history plus a new message using API."""
+    return deepseek_chat(st.session_state.messages + [user_message])
 
 
 def handle_chat_input() -> None:
@@ -216,40 +225,48 @@ def main():
     # page title
     st.title("📈 Stock Analysis AI Chatbot")
 
+    # warm the shared cache for every symbol concurrently, once per session
+    if not st.session_state.prefetched:
+        with st.spinner("Loading stock data..."):
+            asyncio.run(prefetch_all(STOCK_SYMBOLS))
+        st.session_state.prefetched = True
+
+    # sidebar first, so a new symbol shows at once and the user can
+    # always switch away from a symbol that failed to load
+    handle_stock_selection()
+
     try:
-        # gets and cache stock data
-        if st.session_state.stock_data.empty:
-            st.session_state.stock_data = get_stock_data(
-                st.secrets["stock_api_key"],
-                st.session_state.current_symbol
-            )
-
-        # sidebar 
-        handle_stock_selection()
-
-        # display stock data section
-        if not st.session_state.stock_data.empty:
-            metrics = get_stock_metrics(st.session_state.stock_data)
-            display_stock_metrics(metrics)
-
-            fig = create_candlestick_chart(
-                st.session_state.stock_data,
-                st.session_state.current_symbol
-            )
-            st.plotly_chart(fig, use_container_width=True)
+        st.session_state.stock_data = get_stock_data(
+            st.session_state.current_symbol
+        )
+    except ValueError as e:
+        st.session_state.stock_data = None
+        if is_quota_error(e):
+            st.error("FMP API limit (250 requests per day) reached. Try again tomorrow.")
         else:
-            st.warning("No stock data available for selected symbol.")
-
-        # here is the chat interface
-        st.subheader("Stock Analysis Chat")
-        st.write("Limited to the last 5 days of data.")
-        display_example_prompts()
-        display_chat_messages()
-        handle_chat_input()
-
-    except Exception as e:
-        # logging.error(f"Application error: {str(e)}")
-        st.error("FMP API limit (250 requests per day) reached. Try again tomorrow.")
+            st.error(f"Failed to load data: {str(e)}")
+
+    if st.session_state.stock_data is None:
+        st.warning("No stock data available for selected symbol.")
+        return
+
+    # display stock data section
+    metrics = get_stock_metrics(st.session_state.stock_data.ohlc)
+    display_stock_metrics(metrics)
+
+    fig = create_candlestick_chart(st.session_state.stock_data)
+    st.plotly_chart(fig, use_container_width=True)
+
+    # new chat, seed it with the current symbol's data
+    if not st.session_state.messages:
+        seed_chat_context()
+
+    # here is the chat interface
+    st.subheader("Stock Analysis Chat")
+    st.write("Limited to the last 5 days of data.")
+    display_example_prompts()
+    display_chat_messages()
+    handle_chat_input()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,145 @@
+import hashlib
+import os
+import tempfile
+import threading
+from datetime import datetime, timedelta
+from typing import Optional
+
+import pandas as pd
+
+# constants
+# next to this module, not the working directory, so the cache never
+# points at (and prunes) someone else's directory
+CACHE_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), ".cache", "fmp"
+)
+DEFAULT_TTL = timedelta(hours=12)  # daily bars only change once a day
+METADATA_FILE = "metadata.parquet"
+
+# streamlit runs every session in its own thread, writes go through this lock
+_WRITE_LOCK = threading.Lock()
+
+
+class FileCache:
+    """
+    On-disk Parquet cache for DataFrames that survives server restarts.
+
+    Each entry is stored as `<cache_dir>/<md5(key)>.parquet`, and a sidecar
+    `metadata.parquet` records when every entry was fetched so stale
+    entries can be expired. Expired entries are deleted on the next write.
+    """
+
+    def __init__(self, cache_dir: str = CACHE_DIR, ttl: timedelta = DEFAULT_TTL):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.metadata_path = os.path.join(cache_dir, METADATA_FILE)
+
+    @staticmethod
+    def make_key(*parts: str) -> str:
+        """Build a cache key by hashing the given parts."""
+        return hashlib.md5("".join(parts).encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.parquet")
+
+    def _read_metadata(self) -> pd.DataFrame:
+        if not os.path.exists(self.metadata_path):
+            return pd.DataFrame({"fetched_at": pd.Series(dtype="datetime64[ns]")})
+        return pd.read_parquet(self.metadata_path)
+
+    def is_fresh(self, key: str, ttl: Optional[timedelta] = None) -> bool:
+        """
+        Check whether a key has an entry younger than the TTL.
+
+        Args:
+            key (str): cache key from `make_key`
+            ttl (timedelta, optional): overrides the cache's default TTL
+
+        Returns:
+            bool: True if the entry exists and has not expired
+        """
+        if not os.path.exists(self._path(key)):
+            return False
+
+        try:
+            metadata = self._read_metadata()
+        except (OSError, ValueError):
+            # unreadable metadata is treated as a miss
+            return False
+        if key not in metadata.index:
+            return False
+
+        ttl = self.ttl if ttl is None else ttl
+        return datetime.now() - metadata.at[key, "fetched_at"] < ttl
+
+    def get(self, key: str, ttl: Optional[timedelta] = None) -> Optional[pd.DataFrame]:
+        """
+        Return the cached DataFrame for a key.
+
+        Args:
+            key (str): cache key from `make_key`
+            ttl (timedelta, optional): overrides the cache's default TTL
+
+        Returns:
+            pd.DataFrame or None: cached data, or None if missing or expired
+        """
+        if not self.is_fresh(key, ttl):
+            return None
+
+        try:
+            return pd.read_parquet(self._path(key))
+        except (OSError, ValueError):
+            # unreadable cache files are treated as a miss
+            return None
+
+    def is_writable(self) -> bool:
+        """Check whether entries can be written, by creating a probe file."""
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            fd, probe_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+            os.close(fd)
+            os.remove(probe_path)
+        except OSError:
+            return False
+        return True
+
+    def _write_parquet(self, df: pd.DataFrame, path: str) -> None:
+        # write to a unique temp file then rename, so readers never see a
+        # half-written file
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        os.close(fd)
+        try:
+            df.to_parquet(tmp_path)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    def _prune(self, metadata: pd.DataFrame) -> pd.DataFrame:
+        """Delete expired entries, only touching files this cache wrote."""
+        expired = datetime.now() - metadata["fetched_at"] >= self.ttl
+        for key in metadata.index[expired]:
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+
+        return metadata[~expired]
+
+    def set(self, key: str, df: pd.DataFrame) -> None:
+        """
+        Write a DataFrame to the cache and record when it was fetched.
+
+        Best effort: failures are logged and ignored, since the caller
+        already has the data.
+        """
+        try:
+            with _WRITE_LOCK:
+                os.makedirs(self.cache_dir, exist_ok=True)
+                self._write_parquet(df, self._path(key))
+
+                metadata = self._read_metadata()
+                metadata.loc[key, "fetched_at"] = pd.Timestamp(datetime.now())
+                self._write_parquet(self._prune(metadata), self.metadata_path)
+        except (OSError, ValueError) as e:
+            print(f"Failed to write cache entry {key}: {str(e)}")